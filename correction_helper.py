@@ -1,31 +1,66 @@
 """Set of tools to help writing correction bots in Python for Python."""
 
+from __future__ import annotations
+
 import gettext
 import os
 import random
 import resource
+import selectors
 import shlex
 import signal
 import subprocess
 import sys
-from contextlib import contextmanager, redirect_stderr, redirect_stdout
+import time
+import traceback
+from collections import deque
+from contextlib import redirect_stderr, redirect_stdout
 from dataclasses import dataclass
-from io import StringIO
+from functools import cache, lru_cache
+from io import StringIO, TextIOBase
 from itertools import zip_longest
 from pathlib import Path
-from textwrap import indent
-from typing import Optional, Sequence, Tuple, Union
+from typing import TYPE_CHECKING, Optional, Sequence, Tuple, Union
 
-import friendly_traceback
-from friendly_traceback import exclude_file_from_traceback
+if TYPE_CHECKING:
+    import friendly_traceback
 
 __version__ = "2024.16"
 
-friendly_traceback.set_lang(os.environ.get("LANGUAGE", "en"))
 
-exclude_file_from_traceback(__file__)
+@lru_cache(maxsize=4)
+def _get_translation(lang):
+    """Find the "check" translation for the given language, only once.
+
+    gettext.translation walks the filesystem looking for .mo files,
+    no need to redo it per language.
+    """
+    return gettext.translation(
+        "check", Path(__file__).parent, languages=[lang], fallback=True
+    ).gettext
+
 
-_ = gettext.translation("check", Path(__file__).parent, fallback=True).gettext
+_ = _get_translation(os.environ.get("LANGUAGE", "en"))
+
+
+@cache
+def _friendly():
+    """Import and configure friendly_traceback on first actual need.
+
+    friendly_traceback is a heavy import, no point paying for it on
+    checks that never display a student traceback.
+    """
+    import friendly_traceback  # pylint: disable=import-outside-toplevel
+
+    friendly_traceback.set_lang(os.environ.get("LANGUAGE", "en"))
+    friendly_traceback.set_formatter(friendly_traceback_markdown)
+    friendly_traceback.exclude_file_from_traceback(__file__)
+    return friendly_traceback
+
+
+def exclude_file_from_traceback(path):
+    """friendly_traceback.exclude_file_from_traceback, importing it lazily."""
+    return _friendly().exclude_file_from_traceback(path)
 
 
 CFLAGS = (  # For those correcting C code.
@@ -57,14 +92,29 @@ CFLAGS = (  # For those correcting C code.
 )
 
 
+def _indent4(text):
+    """Prefix every line with 4 spaces.
+
+    Faster than textwrap.indent: a single C-level replace instead of a
+    Python-level loop over lines.
+    """
+    return "    " + text.replace("\n", "\n    ")
+
+
+_CODE_PREFIXES = {
+    language: "    :::" + language + "\n" for language in ("text", "python", "pytb")
+}
+
+
 def code(text, language="text"):
     """Transform given text as a Markdown code block."""
-    return "    :::" + language + "\n" + indent(str(text)[: 2**16], "    ")
+    prefix = _CODE_PREFIXES.get(language) or "    :::" + language + "\n"
+    return prefix + _indent4(str(text)[: 2**16])
 
 
-def print_stderr(*args, **kwargs):
-    """`print` wrapper outputing to stderr."""
-    print(*args, **kwargs, file=sys.stderr)
+def print_stderr(*args, sep=" ", end="\n"):
+    """`print` lookalike outputing to stderr in a single write."""
+    sys.stderr.write(sep.join(map(str, args)) + end)
 
 
 def fail(*args, sep="\n\n"):
@@ -77,36 +127,61 @@ def fail(*args, sep="\n\n"):
     sys.exit(1)
 
 
+_CONGRATS_BEGIN_FR = (
+    "Joli",
+    "Bravo",
+    "Bon boulot",
+    "Bien joué",
+    "Super",
+    "Génial",
+    "Bien",
+)
+_CONGRATS_END_FR = (
+    "Belle implémentation",
+    "Bonne réponse",
+    "C'est juste",
+    "C'est bon pour moi",
+    "Cette réponse est correcte",
+    "C'est correct",
+)
+_CONGRATS_BEGIN_EN = ("Congrats", "Nice job", "Well done", "Spot on", "Bravo", "Good")
+_CONGRATS_END_EN = (
+    "Your exercise is OK",
+    "Right answer",
+    "Looks good to me",
+    "Your answer is correct",
+    "Correct answer",
+)
+_CONGRATS_EMOJIS = "     🚀🎉🙌🏆🥇🎯💯"
+
+
+# The language, like for friendly and gettext, is decided once at import.
+_CONGRATS_BEGIN: Tuple[str, ...]
+_CONGRATS_END: Tuple[str, ...]
+if os.environ.get("LANGUAGE", "") == "fr":
+    _CONGRATS_BEGIN, _CONGRATS_END, _CONGRATS_SEP = (
+        _CONGRATS_BEGIN_FR,
+        _CONGRATS_END_FR,
+        " ",
+    )
+else:
+    _CONGRATS_BEGIN, _CONGRATS_END, _CONGRATS_SEP = (
+        _CONGRATS_BEGIN_EN,
+        _CONGRATS_END_EN,
+        "",
+    )
+
+
 def congrats():
     """Generate a generic congratulation sentence."""
-    if os.environ.get("LANGUAGE", "") == "fr":
-        begin = ["Joli", "Bravo", "Bon boulot", "Bien joué", "Super", "Génial", "Bien"]
-        end = [
-            "Belle implémentation",
-            "Bonne réponse",
-            "C'est juste",
-            "C'est bon pour moi",
-            "Cette réponse est correcte",
-            "C'est correct",
-        ]
-        sep = " "
-    else:
-        begin = ["Congrats", "Nice job", "Well done", "Spot on", "Bravo", "Good"]
-        end = [
-            "Your exercise is OK",
-            "Right answer",
-            "Looks good to me",
-            "Your answer is correct",
-            "Correct answer",
-        ]
-        sep = ""
-    return " ".join(
-        [
-            random.choice(begin) + sep + "!" * random.randint(1, 5),
-            random.choice(end) + sep + "!" * random.randint(1, 5),
-            random.choice("     🚀🎉🙌🏆🥇🎯💯"),
-        ]
-    ).strip()
+    begin = random.choice(_CONGRATS_BEGIN) + _CONGRATS_SEP + "!" * random.randint(1, 5)
+    end = random.choice(_CONGRATS_END) + _CONGRATS_SEP + "!" * random.randint(1, 5)
+    return f"{begin} {end} {random.choice(_CONGRATS_EMOJIS)}".strip()
+
+
+# Exceptions whose explanation can't beat the plain traceback, not
+# worth importing and running friendly for them.
+_TRIVIAL_EXCEPTIONS = (KeyboardInterrupt, MemoryError, GeneratorExit)
 
 
 def _handle_student_exception(prefix: Optional[Sequence[str]] = None):
@@ -118,43 +193,146 @@ def _handle_student_exception(prefix: Optional[Sequence[str]] = None):
     """
     if prefix:
         print_stderr(*prefix, sep="\n\n", end="\n\n")
-    friendly_traceback.explain_traceback()
+    if isinstance(sys.exc_info()[1], _TRIVIAL_EXCEPTIONS):
+        # friendly's source reading and analysis add nothing to these,
+        # a plain traceback is just as clear and far cheaper.
+        print_stderr(code(traceback.format_exc(), "pytb"))
+    else:
+        _friendly().explain_traceback()
     sys.exit(1)
 
 
+class ChunkBuffer(TextIOBase):
+    """Lightweight StringIO replacement appending written chunks to a list.
+
+    Joining the chunks once in getvalue avoids the repeated buffer
+    reallocations StringIO pays for on each write.
+    """
+
+    def __init__(self):
+        """Start with no chunk written."""
+        super().__init__()
+        self.chunks: list = []
+
+    def writable(self):
+        """Tell we accept writes, that's the whole point."""
+        return True
+
+    def write(self, string):
+        """Store the given string, to be joined by getvalue."""
+        self.chunks.append(string)
+        return len(string)
+
+    def getvalue(self):
+        """Join all written chunks in a single string."""
+        return "".join(self.chunks)
+
+
+class FirstLastBuffer(ChunkBuffer):
+    """ChunkBuffer keeping only the first and last `keep` chars written.
+
+    Bounds what a student printing in an infinite loop can make us
+    allocate before the deadline fires: the middle of the output is
+    dropped, like truncate() does, but while capturing.
+    """
+
+    def __init__(self, keep=2**20):
+        """Keep at most `keep` chars of head and `keep` chars of tail."""
+        super().__init__()
+        self.keep = keep
+        self.size = 0  # Chars kept in self.chunks (the head).
+        self.tail: deque = deque()
+        self.tail_size = 0
+        self.dropped = 0
+
+    def write(self, string):
+        """Store the given string, dropping middle chars when over budget."""
+        if self.size < self.keep:
+            self.size += len(string)
+            return super().write(string)
+        self.tail.append(string)
+        self.tail_size += len(string)
+        while self.tail_size - len(self.tail[0]) >= self.keep:
+            oldest = self.tail.popleft()
+            self.tail_size -= len(oldest)
+            self.dropped += len(oldest)
+        return len(string)
+
+    def getvalue(self):
+        """Join what has been kept, materializing an ellipsis if needed."""
+        head = super().getvalue()
+        tail = "".join(self.tail)
+        if not self.dropped:
+            return head + tail
+        return head + f"\n…({self.dropped} truncated chars)…\n" + tail
+
+
+def _stripped(value):
+    """value.strip(), but skipping the full copy when there's nothing to strip."""
+    if not value or not (value[0].isspace() or value[-1].isspace()):
+        return value
+    return value.strip()
+
+
 class Run:
     """Representation for a program or function run storing stdout and stderr."""
 
-    def __init__(self, stdout: StringIO, stderr: StringIO):
-        """Create a Run instance from two StringIO (or Twin instances)."""
+    def __init__(self, stdout: ChunkBuffer, stderr: ChunkBuffer):
+        """Create a Run instance from two ChunkBuffer instances."""
         self.stdout = stdout
         self.stderr = stderr
 
     @property
     def out(self):
         """Stdout, stripped."""
-        return self.stdout.getvalue().strip()
+        return _stripped(self.stdout.getvalue())
 
     @property
     def err(self):
         """Stderr, stripped."""
-        return self.stderr.getvalue().strip()
+        return _stripped(self.stderr.getvalue())
 
 
-@contextmanager
-def deadline(timeout=1):
-    """Context manager raising a TimeoutError after a given deadline in seconds."""
+def _deadline_handler(signum, frame):
+    """Tell the code under deadline() its time is up."""
+    raise TimeoutError
 
-    def handler(signum, frame):
-        raise TimeoutError
 
-    signal.signal(signal.SIGALRM, handler)
-    signal.alarm(timeout)
-    yield
-    signal.alarm(0)
+class deadline:  # pylint: disable=invalid-name
+    """Context manager raising a TimeoutError after a given deadline in seconds.
 
+    A plain class, not a @contextmanager generator: student_code enters
+    one per run and the generator machinery costs more than it helps.
+    """
 
-def _prepare_message(
+    _handler_installed = False
+
+    def __init__(self, timeout=1):
+        """Remember the deadline, in seconds (may be fractional)."""
+        self.timeout = timeout
+
+    def __enter__(self):
+        """Arm the timer (no-op on platforms without SIGALRM).
+
+        The handler is registered on first use only: one sigaction
+        syscall per process instead of one per run. setitimer instead
+        of alarm so sub-second timeouts work.
+        """
+        if hasattr(signal, "SIGALRM"):  # Windows has no SIGALRM, no deadline.
+            if not deadline._handler_installed:
+                signal.signal(signal.SIGALRM, _deadline_handler)
+                deadline._handler_installed = True
+            signal.setitimer(signal.ITIMER_REAL, self.timeout)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        """Disarm the timer, propagate any exception."""
+        if hasattr(signal, "SIGALRM"):
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        return False
+
+
+def _prepare_message_uncached(
     prefix: Union[Sequence[str], str], message: Union[Sequence[str], str, None] = None
 ) -> Tuple[str, ...]:
     if isinstance(prefix, str):
@@ -170,17 +348,21 @@ def _prepare_message(
     return prefix + message
 
 
-@contextmanager
-def student_code(  # pylint: disable=too-many-arguments,too-many-branches
-    *,
-    prefix=(),
-    exception_prefix="",
-    print_allowed=True,  # pylint: disable=redefined-outer-name
-    print_hook=None,
-    print_prefix="Your code printed:",
-    too_slow_message="Your program looks too slow, looks like an infinite loop.",
-    timeout=1,
-):
+_prepare_message_cached = lru_cache(maxsize=256)(_prepare_message_uncached)
+
+
+def _prepare_message(
+    prefix: Union[Sequence[str], str], message: Union[Sequence[str], str, None] = None
+) -> Tuple[str, ...]:
+    # The same prefixes come back for every student_code call of a
+    # grader loop, so remember the normalized tuples.
+    try:
+        return _prepare_message_cached(prefix, message)
+    except TypeError:  # Unhashable, lists typically: normalize uncached.
+        return _prepare_message_uncached(prefix, message)
+
+
+class student_code:  # pylint: disable=invalid-name,too-many-instance-attributes
     """Execute student code under surveillance.
 
     It help them spot common errors like:
@@ -215,56 +397,102 @@ def student_code(  # pylint: disable=too-many-arguments,too-many-branches
     print(run.out, run.err)  # You have access to what they tried to write
                              # to stdout and stderr (both stripped).
 
+    A plain class, not a @contextmanager generator, to spare the
+    generator frame and gen.throw round-trip on every run.
     """
-    exception_prefix = _prepare_message(prefix, exception_prefix)
-    print_prefix = _prepare_message(prefix, print_prefix)
-    too_slow_message = _prepare_message(prefix, too_slow_message)
-
-    old_stdin = sys.stdin
-    capture = Run(StringIO(), StringIO())
-    old_soft, old_hard = resource.getrlimit(resource.RLIMIT_AS)
-    resource.setrlimit(  # 1GB should be enough for anybody
-        resource.RLIMIT_AS, (1024**3, old_hard)
-    )
-    try:
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        *,
+        prefix=(),
+        exception_prefix="",
+        print_allowed=True,  # pylint: disable=redefined-outer-name
+        print_hook=None,
+        print_prefix="Your code printed:",
+        too_slow_message="Your program looks too slow, looks like an infinite loop.",
+        timeout=1,
+        memory_limit=1024**3,  # Should be enough for anybody
+        restore_memory_limit=True,
+    ):
+        """Store the configuration, the surveillance starts in __enter__.
+
+        memory_limit can be None to skip limiting memory entirely, and
+        restore_memory_limit can be False for one-shot graders exiting
+        right after the check anyway.
+        """
+        self.exception_prefix = _prepare_message(prefix, exception_prefix)
+        self.print_prefix = _prepare_message(prefix, print_prefix)
+        self.too_slow_message = _prepare_message(prefix, too_slow_message)
+        self.print_allowed = print_allowed
+        self.print_hook = print_hook
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.restore_memory_limit = restore_memory_limit
+        self.capture = Run(FirstLastBuffer(), FirstLastBuffer())
+        self.old_stdin = None
+        self.old_limits = None
+        self.redirects: tuple = ()
+        self.deadline = None
+
+    def __enter__(self):
+        """Limit memory, plug the student's stdin/stdout/stderr, arm the alarm."""
+        if self.memory_limit is not None:
+            old_soft, old_hard = resource.getrlimit(resource.RLIMIT_AS)
+            if old_soft == resource.RLIM_INFINITY or old_soft > self.memory_limit:
+                self.old_limits = (old_soft, old_hard)
+                resource.setrlimit(resource.RLIMIT_AS, (self.memory_limit, old_hard))
+        self.old_stdin = sys.stdin
         sys.stdin = None
-        with redirect_stdout(capture.stdout):
-            with redirect_stderr(capture.stderr):
-                with deadline(timeout):
-                    yield capture
-                resource.setrlimit(resource.RLIMIT_AS, (old_soft, old_hard))
-    except TimeoutError:
-        resource.setrlimit(resource.RLIMIT_AS, (old_soft, old_hard))
-        fail(*too_slow_message)
-    except SystemExit:
-        resource.setrlimit(resource.RLIMIT_AS, (old_soft, old_hard))
-        fail(
-            """Your program tried to exit,
-remove any `exit()` or `sys.exit()` from your code,
-else I won't be able to check it."""
+        self.redirects = (
+            redirect_stdout(self.capture.stdout),
+            redirect_stderr(self.capture.stderr),
         )
-    except RuntimeError as err:
-        resource.setrlimit(resource.RLIMIT_AS, (old_soft, old_hard))
-        if "lost sys.stdin" not in str(err):
-            _handle_student_exception(exception_prefix)
-        fail("Don't use the `input` builtin, there's no human to interact with here.")
-    except:  # noqa  pylint: disable=bare-except
-        resource.setrlimit(resource.RLIMIT_AS, (old_soft, old_hard))
-        _handle_student_exception(exception_prefix)
-    finally:
-        resource.setrlimit(resource.RLIMIT_AS, (old_soft, old_hard))
-        sys.stdin = old_stdin
-    if capture.err or capture.out:
-        if print_hook:
-            print_hook(capture.out, capture.err)
-        elif print_allowed is not None:
-            print(*print_prefix, sep="\n\n", end="\n\n")
-            if capture.err:
-                print(code(capture.err, language="text"))
-            if capture.out:
-                print(code(capture.out, language="text"))
-            if print_allowed is False:
-                sys.exit(1)
+        for redirect in self.redirects:
+            redirect.__enter__()
+        self.deadline = deadline(self.timeout)
+        self.deadline.__enter__()
+        return self.capture
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        """Undo __enter__, explain any student failure, check the prints."""
+        self.deadline.__exit__(exc_type, exc_value, exc_tb)
+        for redirect in reversed(self.redirects):
+            redirect.__exit__(exc_type, exc_value, exc_tb)
+        if self.old_limits is not None:
+            if self.restore_memory_limit:
+                resource.setrlimit(resource.RLIMIT_AS, self.old_limits)
+            self.old_limits = None
+        sys.stdin = self.old_stdin
+        if exc_type is not None:
+            self._handle_exception(exc_type, exc_value)
+        capture = self.capture
+        if capture.err or capture.out:
+            if self.print_hook:
+                self.print_hook(capture.out, capture.err)
+            elif self.print_allowed is not None:
+                parts = ["\n\n".join(self.print_prefix), "\n\n"]
+                if capture.err:
+                    parts += (code(capture.err, language="text"), "\n")
+                if capture.out:
+                    parts += (code(capture.out, language="text"), "\n")
+                sys.stdout.write("".join(parts))
+                if self.print_allowed is False:
+                    sys.exit(1)
+        return False
+
+    def _handle_exception(self, exc_type, exc_value):
+        """Translate a student exception to a nice message, and exit."""
+        if issubclass(exc_type, TimeoutError):
+            fail(*self.too_slow_message)
+        if issubclass(exc_type, SystemExit):
+            fail("""Your program tried to exit,
+remove any `exit()` or `sys.exit()` from your code,
+else I won't be able to check it.""")
+        if issubclass(exc_type, RuntimeError) and "lost sys.stdin" in str(exc_value):
+            fail(
+                "Don't use the `input` builtin, there's no human to interact with here."
+            )
+        _handle_student_exception(self.exception_prefix)
 
 
 def print_denied(message="Your code printed:"):
@@ -355,9 +583,10 @@ def admonition(admonition_type, *body, title=""):
     !!! note ""
         Hello world.
     """
-    print(f'!!! {admonition_type} "{title}"\n')
+    parts = [f'!!! {admonition_type} "{title}"\n\n']
     for item in body:
-        print(indent(item, "    "), sep="\n\n", end="\n\n")
+        parts.append(_indent4(item) + "\n\n")
+    sys.stdout.write("".join(parts))
 
 
 @dataclass
@@ -388,6 +617,25 @@ MARKDOWN_ITEMS = [
 ]
 
 
+# The branchy per-Section decisions (is it a title? which code fence?)
+# only depend on MARKDOWN_ITEMS, so take them once at import time.
+_MARKDOWN_ITEMS_COMPILED = tuple(
+    (
+        item.name,
+        item.prefix,
+        item.suffix,
+        (
+            "    :::" + str(item.highlight) + "\n"
+            if isinstance(item.highlight, str)
+            else ""
+        ),
+        bool(item.highlight),
+        item.prefix.startswith("#"),
+    )
+    for item in MARKDOWN_ITEMS
+)
+
+
 def friendly_traceback_markdown(
     info: friendly_traceback.typing_info.Info,
     include: Optional[  # pylint: disable=unused-argument
@@ -396,57 +644,190 @@ def friendly_traceback_markdown(
 ) -> str:
     """Traceback formatted with full information but with markdown syntax."""
     result = []
-    for item in MARKDOWN_ITEMS:
-        if item.name in info:
-            line = info[item.name]  # type: ignore
-            if not isinstance(line, str):
+    for name, prefix, suffix, fence, highlight, is_title in _MARKDOWN_ITEMS_COMPILED:
+        if name in info:
+            line = info[name]  # type: ignore
+            if line.__class__ is not str:
                 line = "\n".join(line)
-            if item.name == "simulated_python_traceback":
+            if name == "simulated_python_traceback":
                 line = line.replace("Simulated Traceback", "Traceback")
-            if item.prefix[:1] == "#":
+            if is_title:
                 line = line.rstrip(": ")  # Do not end titles with column
-            if item.highlight is True:
-                line = indent(line, "    ")
-            elif item.highlight:
-                line = "    :::" + str(item.highlight) + "\n" + indent(line, "    ")
-            result.append(item.prefix + line + item.suffix + "\n\n")
+            if highlight:
+                line = fence + _indent4(line)
+            result.append(prefix + line + suffix + "\n\n")
     return "\n".join(result)
 
 
-friendly_traceback.set_formatter(friendly_traceback_markdown)
+_NO_TRUNCATE = bool(os.environ.get("CORRECTION_HELPER_NO_TRUNCATE"))
 
 
 def truncate(string):
     """May truncate string if it's too long."""
-    if os.environ.get("CORRECTION_HELPER_NO_TRUNCATE"):
+    if len(string) < 4096:  # The common case, test it first.
         return string
-    if len(string) < 4096:
+    if _NO_TRUNCATE:
         return string
     return string[:512] + f"\n…({len(string)-1024} truncated chars)…\n" + string[-512:]
 
 
 def to_string(value: str | bytes) -> str:
+    """Decode bytes to str, pass str through."""
     if isinstance(value, bytes):
         return value.decode("ASCII", "backslashreplace")
     return value
 
 
-def _run(file, *args, **kwargs):  # pylint: disable=too-many-branches
-    """subprocess.run wrapper explaining failure cases."""
+def _limit_child_memory():
+    """Run in the child between fork and exec to cap its address space."""
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    soft = 1024**3 if hard == resource.RLIM_INFINITY else min(1024**3, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+
+_CAPTURE_CAP = 2**20  # Bytes of each child stream kept in memory.
+
+
+class _FirstLastBytes:
+    """FirstLastBuffer's head+tail policy, for raw child output.
+
+    Keeps the first and last `keep` bytes and counts what was dropped
+    in between, so a truncated capture says so instead of just ending
+    mid-stream.
+    """
+
+    def __init__(self, keep=_CAPTURE_CAP):
+        """Keep at most `keep` bytes of head and `keep` bytes of tail."""
+        self.keep = keep
+        self.head = bytearray()
+        self.tail: deque = deque()
+        self.tail_size = 0
+        self.dropped = 0
+
+    def extend(self, chunk):
+        """Store the given bytes, dropping middle bytes when over budget."""
+        if len(self.head) < self.keep:
+            self.head.extend(chunk)
+            return
+        self.tail.append(chunk)
+        self.tail_size += len(chunk)
+        while self.tail_size - len(self.tail[0]) >= self.keep:
+            oldest = self.tail.popleft()
+            self.tail_size -= len(oldest)
+            self.dropped += len(oldest)
+
+    def getvalue(self):
+        """Join what has been kept, materializing an ellipsis if needed."""
+        tail = b"".join(self.tail)
+        if not self.dropped:
+            return bytes(self.head) + tail
+        marker = f"\n…({self.dropped} truncated bytes)…\n".encode()
+        return bytes(self.head) + marker + tail
+
+
+def _drain(proc, timeout):
+    """Read proc's stdout/stderr to EOF, keeping _CAPTURE_CAP bytes of each.
+
+    Past the cap we keep reading (so the child never stalls on a full
+    pipe), but like FirstLastBuffer only the head and tail are kept,
+    so a child printing in an infinite loop can't eat the grader's
+    memory. Raises subprocess.TimeoutExpired, child killed, when the
+    deadline is reached first.
+    """
+    ends_at = None if timeout is None else time.monotonic() + timeout
+    out_buf = _FirstLastBytes()
+    err_buf = _FirstLastBytes()
+    buffers = {proc.stdout: out_buf, proc.stderr: err_buf}
+    with selectors.DefaultSelector() as selector:
+        for stream in (proc.stdout, proc.stderr):
+            if stream is not None:
+                selector.register(stream, selectors.EVENT_READ)
+        while selector.get_map():
+            wait = None if ends_at is None else ends_at - time.monotonic()
+            if wait is not None and wait <= 0:
+                break
+            for key, _ in selector.select(wait):
+                chunk = os.read(key.fd, 2**16)
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                else:
+                    buffers[key.fileobj].extend(chunk)
+    try:
+        proc.wait(None if ends_at is None else max(ends_at - time.monotonic(), 0))
+    except subprocess.TimeoutExpired:
+        pass
+    if proc.returncode is None:
+        proc.kill()
+        proc.wait()
+        raise subprocess.TimeoutExpired(
+            proc.args, timeout, output=out_buf.getvalue(), stderr=err_buf.getvalue()
+        )
+    return out_buf.getvalue(), err_buf.getvalue()
+
+
+def _run(
+    file, *args, timeout=60, capture_stdout=True, **kwargs
+):  # pylint: disable=too-many-branches
+    """subprocess.run wrapper explaining failure cases.
+
+    With capture_stdout=False the child's stdout goes to /dev/null and
+    an empty string is returned: callers that only care about side
+    effects or stderr don't pay for draining and decoding the output.
+    """
+    stdout = subprocess.PIPE if capture_stdout else subprocess.DEVNULL
     if kwargs.get("input") is None and "stdin" not in kwargs:
         kwargs["stdin"] = subprocess.DEVNULL
-    start_hint = ""
-    if args:
-        start_hint = "I started it as:\n\n" + code(
-            file + " " + " ".join(shlex.quote(a) for a in args)
-        )
+    kwargs.setdefault(  # 1GB should be enough for anybody
+        "preexec_fn", _limit_child_memory
+    )
+    text = kwargs.pop("text", False)
+
+    def start_hint():
+        """Built only on failure, the happy path never shows it."""
+        if not args:
+            return ""
+        return "I started it as:\n\n" + code(shlex.join([file, *args]))
+
     try:
-        proc = subprocess.run(
-            [file, *args],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            check=True,
-            **kwargs,
+        if kwargs.get("input") is not None:
+            # Feeding stdin needs communicate(), let subprocess.run drive.
+            proc = subprocess.run(
+                [file, *args],
+                stdout=stdout,
+                stderr=subprocess.PIPE,
+                check=True,
+                timeout=timeout,
+                text=text,
+                **kwargs,
+            )
+            out, err_out = proc.stdout, proc.stderr
+        else:
+            with subprocess.Popen(
+                [file, *args],
+                stdout=stdout,
+                stderr=subprocess.PIPE,
+                **kwargs,
+            ) as proc:
+                out, err_out = _drain(proc, timeout)
+            if text:
+                out = out.decode(errors="replace")
+                err_out = err_out.decode(errors="replace")
+            if proc.returncode:
+                raise subprocess.CalledProcessError(
+                    proc.returncode, proc.args, out, err_out
+                )
+    except subprocess.TimeoutExpired as err:
+        stdout = stderr = ""
+        if err.stdout:
+            stdout = "Your code printed:\n\n" + code(truncate(to_string(err.stdout)))
+        if err.stderr:
+            stderr = "Found this on stderr:\n\n" + code(truncate(to_string(err.stderr)))
+        fail(
+            "I had to halt your program, it took too long to complete.",
+            "Check for an infinite loop maybe?",
+            start_hint(),
+            stdout,
+            stderr,
         )
     except subprocess.CalledProcessError as err:
         stdout = stderr = ""
@@ -459,24 +840,26 @@ def _run(file, *args, **kwargs):  # pylint: disable=too-many-branches
                 "I had to halt your program, sorry...",
                 "It were either too slow, or consuming too much resources.",
                 "Check for an infinite loop maybe?",
-                start_hint,
+                start_hint(),
                 stdout,
                 stderr,
             )
         fail(
             f"Your program exited with the error code: {err.returncode}.",
-            start_hint,
+            start_hint(),
             stdout,
             stderr,
         )
     except MemoryError:
         fail(
             "Your program is eating up all the memory! Check for infinite loops maybe?",
-            start_hint,
+            start_hint(),
         )
-    if proc.stderr:
-        fail(proc.stderr)
-    return proc.stdout.rstrip()
+    if err_out:
+        fail(to_string(err_out))
+    if not capture_stdout:
+        return ""
+    return out.rstrip()
 
 
 def run(file, *args, **kwargs):
@@ -486,6 +869,9 @@ def run(file, *args, **kwargs):
 
 def run_py(file, *args, **kwargs):
     """subprocess.run wrapper specialized to run Python with friendly."""
+    kwargs.setdefault(  # No point writing __pycache__ for a one-shot check.
+        "env", {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    )
     return _run(
         sys.executable,
         "-m",
@@ -516,6 +902,16 @@ def code_or_repr(some_string):
     return "\n\n" + code(some_string)
 
 
+# Translations can't change after import, so look them up once instead
+# of once per differing line in compare().
+_MSG_UNEXPECTED_LINE = _("Unexpected line {line}, you gave:")
+_MSG_TOO_SHORT = _("Your output is too short, missing line {line}, I'm expecting:")
+_MSG_EXPECTING = _("On line {line} I'm expecting:")
+_MSG_YOU_GAVE = _("You gave:")
+_MSG_YOU_GAVE_NOTHING = _("You gave nothing.")
+_MSG_FULL_OUTPUT = _("Just in case it helps, here's your full output:")
+
+
 def compare(expected, theirs, preamble=""):
     """Compare two results.
 
@@ -524,56 +920,46 @@ def compare(expected, theirs, preamble=""):
     Both can be multi-lines, and if they differ, a proper message will
     be raised, using correction_helper.fail.
     """
+    if expected is theirs or expected == theirs:
+        return  # Equal before stripping: skip the two stripped copies.
     if expected.strip() == theirs.strip():
         return
+    expected_lines = (line.removesuffix("\n") for line in StringIO(expected))
+    their_lines = (line.removesuffix("\n") for line in StringIO(theirs))
     for line, (expected_line, their_line) in enumerate(
-        zip_longest(expected.split("\n"), theirs.split("\n")), start=1
+        zip_longest(expected_lines, their_lines), start=1
     ):
         if expected_line != their_line:
             if expected_line is None:
                 fail(
                     preamble,
-                    _("Unexpected line {line}, you gave:").format(line=line)
-                    + code_or_repr(their_line),
-                    _("Just in case it helps, here's your full output:"),
-                    code(theirs),
+                    _MSG_UNEXPECTED_LINE.format(line=line) + code_or_repr(their_line),
+                    _MSG_FULL_OUTPUT,
+                    code(truncate(theirs)),
                 )
             elif their_line is None:
                 fail(
                     preamble,
-                    _(
-                        "Your output is too short, missing line {line}, I'm expecting:"
-                    ).format(line=line)
-                    + code_or_repr(expected_line),
-                    _("Just in case it helps, here's your full output:"),
-                    code(theirs),
+                    _MSG_TOO_SHORT.format(line=line) + code_or_repr(expected_line),
+                    _MSG_FULL_OUTPUT,
+                    code(truncate(theirs)),
                 )
             else:
                 hint = ""
                 trailer = ""
                 if their_line != theirs:
-                    trailer = (
-                        _("Just in case it helps, here's your full output:")
-                        + "\n\n"
-                        + code(theirs)
-                    )
-                if expected_line and their_line:
-                    if their_line[0] == " " and expected_line[0] != " ":
-                        hint = (
-                            "\n\n" + "(Notice your line starts with a space, not mine.)"
-                        )
-                    if their_line[-1] == " " and expected_line[-1] != " ":
-                        hint = (
-                            "\n\n" + "(Notice your line ends with a space, not mine.)"
-                        )
+                    trailer = _MSG_FULL_OUTPUT + "\n\n" + code(truncate(theirs))
+                if their_line.startswith(" ") and not expected_line.startswith(" "):
+                    hint = "\n\n" + "(Notice your line starts with a space, not mine.)"
+                if their_line.endswith(" ") and not expected_line.endswith(" "):
+                    hint = "\n\n" + "(Notice your line ends with a space, not mine.)"
                 fail(
                     preamble,
-                    _("On line {line} I'm expecting:").format(line=line)
-                    + code_or_repr(expected_line),
+                    _MSG_EXPECTING.format(line=line) + code_or_repr(expected_line),
                     (
-                        (_("You gave:") + code_or_repr(their_line))
+                        (_MSG_YOU_GAVE + code_or_repr(their_line))
                         if their_line
-                        else _("You gave nothing.")
+                        else _MSG_YOU_GAVE_NOTHING
                     ),
                     hint,
                     trailer,
@@ -581,7 +967,7 @@ def compare(expected, theirs, preamble=""):
     fail(
         preamble,
         "Looks like a wrong answer, expected:",
-        code(expected),
+        code(truncate(expected)),
         "you gave:",
-        code(theirs),
+        code(truncate(theirs)),
     )
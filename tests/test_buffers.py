@@ -0,0 +1,21 @@
+from correction_helper import FirstLastBuffer
+
+
+def test_keeps_everything_under_budget():
+    buffer = FirstLastBuffer()
+    buffer.write("Hello")
+    buffer.write(" world")
+    assert buffer.getvalue() == "Hello world"
+    assert buffer.dropped == 0
+
+
+def test_drops_the_middle():
+    buffer = FirstLastBuffer(keep=10)
+    for i in range(100):
+        buffer.write(f"{i:04}\n")
+    value = buffer.getvalue()
+    assert value.startswith("0000\n")
+    assert value.endswith("0099\n")
+    assert "truncated chars" in value
+    assert buffer.dropped > 0
+    assert len(value) < 100  # Way less than the 500 chars written.
@@ -1,3 +1,5 @@
+import resource
+
 import pytest
 from correction_helper import student_code, code
 
@@ -39,6 +41,22 @@ def test_not_die_on_no_print(capsys):
     assert not run.err
 
 
+def test_student_code_memory_limit(capsys):
+    with pytest.raises(SystemExit):
+        with student_code(memory_limit=1024**3):
+            bytearray(4 * 1024**3)
+    out, err = capsys.readouterr()
+    assert "MemoryError" in err
+    assert not out
+
+
+def test_student_code_restores_memory_limit():
+    before = resource.getrlimit(resource.RLIMIT_AS)
+    with student_code(memory_limit=1024**3):
+        pass
+    assert resource.getrlimit(resource.RLIMIT_AS) == before
+
+
 def test_student_code_during_print_check(capsys):
     with pytest.raises(SystemExit):
         with student_code(print_allowed=False):
@@ -0,0 +1,35 @@
+import sys
+
+import pytest
+
+from correction_helper import run
+
+
+def test_run():
+    assert run(sys.executable, "-c", "print('hello')", text=True) == "hello"
+
+
+def test_run_too_slow(capsys):
+    with pytest.raises(SystemExit):
+        run(sys.executable, "-c", "import time; time.sleep(60)", timeout=0.5)
+    out, err = capsys.readouterr()
+    assert "I had to halt your program" in out
+    assert not err
+
+
+def test_run_too_slow_shows_partial_output(capsys):
+    with pytest.raises(SystemExit):
+        run(
+            sys.executable,
+            "-c",
+            "import time; print('before sleeping', flush=True); time.sleep(60)",
+            timeout=0.5,
+        )
+    out, err = capsys.readouterr()
+    assert "before sleeping" in out
+    assert not err
+
+
+def test_run_no_capture():
+    out = run(sys.executable, "-c", "print('ignored')", capture_stdout=False)
+    assert out == ""